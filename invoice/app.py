@@ -3,100 +3,133 @@ from reportlab.pdfgen import canvas
 from reportlab.lib.pagesizes import A4
 from reportlab.lib import colors
 from reportlab.lib.utils import ImageReader
-from werkzeug.utils import secure_filename
+from reportlab.pdfbase.pdfmetrics import stringWidth
+from PIL import Image
 import os
+import io
+import math
+import re
+import hashlib
 import threading
-import time
-from datetime import datetime, timedelta
-import tempfile
-
-try:
-    import cairosvg
-except ImportError:
-    cairosvg = None
-except Exception as e:
-    print(f"⚠️ Warning: Could not load cairosvg: {e}")
-    cairosvg = None
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 
 app = Flask(__name__)
 
 # Check if running on Vercel or similar serverless env
 IS_VERCEL = "VERCEL" in os.environ
 
-if IS_VERCEL:
-    # Vercel's writable directory
-    BASE_TEMP = "/tmp"
-    app.config['UPLOAD_FOLDER'] = os.path.join(BASE_TEMP, 'uploads')
-    app.config['OUTPUT_FOLDER'] = os.path.join(BASE_TEMP, 'output')
-else:
-    app.config['UPLOAD_FOLDER'] = 'uploads'
-    app.config['OUTPUT_FOLDER'] = 'output'
-
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024
 
-# Ensure necessary directories exist
-os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
-os.makedirs(app.config['OUTPUT_FOLDER'], exist_ok=True)
+# Shared render pool; caps how many PDFs are built at once across request threads
+_POOL = ThreadPoolExecutor(max_workers=4)
+
 os.makedirs('templates', exist_ok=True)
 
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'svg'}
 
+# Product row form keys; indices are length-capped so int() stays cheap
+_ROW_KEY = re.compile(r'product_(name|quantity|price|total)_([0-9]{1,6})')
+MAX_ROWS = 200
+
+# Strips currency symbols and thousands separators from product totals
+_TBL = str.maketrans('', '', '$,')
+
+# Invariant invoice styling and layout
+_BG_SECTION = colors.HexColor("#eeeeee")
+_BORDER = colors.HexColor("#d1d1d1")
+_TEXT_MAIN = colors.black
+_TABLE_HEADERS = (("NO.", 55), ("ITEM DESCRIPTION", 230), ("QTY", 375), ("PRICE", 435), ("DISCOUNT", 500), ("TOTAL", 555))
+_COLS_X = (40, 70, 320, 390, 440, 490, 535, 580)
+_CUSTOMER_FIELDS = (("COMPANY", 'client_name'), ("PHONE NO", 'client_phone'), ("EMAIL", 'client_email'))
+_PKR_FMT = "{:,.0f} PKR".format
+# Plain-text footer labels; Helvetica has no emoji glyphs
+_FOOTER_PREFIX = "Email: "
+_FOOTER_SEP = "  |  Web: "
+
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
-def cleanup_old_files():
-    """Background task to remove files older than 1 minute."""
-    while True:
-        try:
-            current_time = datetime.now()
-            for folder in [app.config['OUTPUT_FOLDER'], app.config['UPLOAD_FOLDER']]:
-                if not os.path.exists(folder): continue
-                for filename in os.listdir(folder):
-                    filepath = os.path.join(folder, filename)
-                    if os.path.isfile(filepath):
-                        file_time = datetime.fromtimestamp(os.path.getmtime(filepath))
-                        if current_time - file_time > timedelta(minutes=1):
-                            os.remove(filepath)
-        except Exception as e:
-            print(f"Cleanup error: {e}")
-        time.sleep(30)
+def _collect_rows(data):
+    """Groups product_<field>_<idx> form keys into an ordered list of at most MAX_ROWS row dicts."""
+    rows = {}
+    for k, v in data.items():
+        if (m := _ROW_KEY.fullmatch(k)):
+            rows.setdefault(int(m.group(2)), {})[m.group(1)] = v
+    return [rows[i] for i in sorted(rows) if rows[i].get('name', '').strip()][:MAX_ROWS]
 
-def start_cleanup_thread():
-    cleanup_thread = threading.Thread(target=cleanup_old_files, daemon=True)
-    cleanup_thread.start()
+# Sized so a full MAX_ROWS table does not evict the company name between invoices
+@lru_cache(maxsize=1024)
+def _sw(text, font, size):
+    """Memoized font metric lookup; company names and table cells repeat across invoices."""
+    return stringWidth(text, font, size)
 
-def convert_svg_to_png(svg_path):
-    """Converts SVG to PNG for ReportLab compatibility."""
-    png_path = os.path.join(app.config['UPLOAD_FOLDER'], f"conv_{datetime.now().strftime('%Y%m%d%H%M%S%f')}.png")
+@lru_cache(maxsize=None)
+def _load_cairosvg():
+    """Imports cairosvg on first use; it is slow to import and only needed for SVG logos."""
     try:
-        if cairosvg:
-            cairosvg.svg2png(url=svg_path, write_to=png_path)
-            return png_path if os.path.exists(png_path) else None
+        import cairosvg
+        return cairosvg
+    except ImportError:
+        return None
     except Exception as e:
-        print(f"SVG Conversion failed: {e}")
-    return None
+        print(f"⚠️ Warning: Could not load cairosvg: {e}")
+        return None
 
-def create_invoice_pdf(data, logo_path, output_filename):
-    """Generates a premium invoice PDF based on the Lancers Tech design."""
+def _safe_float(value):
+    """Parses a product total already stripped of '$' and ',', treating malformed or non-finite input as 0."""
+    try:
+        number = float(value)
+    except ValueError:
+        return 0.0
+    return number if math.isfinite(number) else 0.0
+
+# Logos are rasterized at 2x the drawn width so they stay crisp
+_LOGO_PX = 160
+_LOGO_CACHE_SIZE = 32
+# (sha1 hex digest, is_svg) -> rasterized PNG bytes, least recently used first
+_logo_cache = OrderedDict()
+_logo_cache_lock = threading.Lock()
+
+def _rasterize_logo(raw, is_svg):
+    """Converts an uploaded logo to PNG bytes no wider than _LOGO_PX."""
+    if is_svg:
+        return _load_cairosvg().svg2png(bytestring=raw, output_width=_LOGO_PX)
+    with Image.open(io.BytesIO(raw)) as img:
+        if img.width > _LOGO_PX:
+            img.thumbnail((_LOGO_PX, img.height))
+        if img.mode not in ('1', 'L', 'LA', 'P', 'RGB', 'RGBA'):
+            img = img.convert('RGBA')
+        out = io.BytesIO()
+        img.save(out, format='PNG')
+    return out.getvalue()
+
+def _logo_png(raw, is_svg):
+    """Returns the rasterized PNG for a logo, cached by content hash and format."""
+    key = (hashlib.sha1(raw).hexdigest(), is_svg)
+    with _logo_cache_lock:
+        png = _logo_cache.get(key)
+        if png is not None:
+            _logo_cache.move_to_end(key)
+            return png
+    png = _rasterize_logo(raw, is_svg)
+    with _logo_cache_lock:
+        _logo_cache[key] = png
+        if len(_logo_cache) > _LOGO_CACHE_SIZE:
+            _logo_cache.popitem(last=False)
+    return png
+
+def create_invoice_pdf(data, logo_bytes, is_svg, out):
+    """Generates a premium invoice PDF based on the Lancers Tech design into the file-like `out`."""
     width, height = A4
-    c = canvas.Canvas(output_filename, pagesize=A4)
+    c = canvas.Canvas(out, pagesize=A4)
     
-    # Process logo (convert SVG if needed)
-    final_logo_path = None
-    if logo_path and os.path.exists(logo_path):
-        if logo_path.lower().endswith('.svg'):
-            final_logo_path = convert_svg_to_png(logo_path)
-        else:
-            final_logo_path = logo_path
-
     # Extract Theme Colors
     primary_hex = data.get('primary_color', '#f7a80a')
     secondary_hex = data.get('secondary_color', '#2d2d2d')
     PRIMARY = colors.HexColor(primary_hex)
     SECONDARY = colors.HexColor(secondary_hex)
-    BG_SECTION = colors.HexColor("#eeeeee")
-    TEXT_MAIN = colors.black
-    BORDER = colors.HexColor("#d1d1d1")
 
     # 1. TOP DECORATION
     c.setFillColor(SECONDARY)
@@ -119,14 +152,16 @@ def create_invoice_pdf(data, logo_path, output_filename):
     logo_w = 80
     logo_drawn = False
     
-    if final_logo_path and os.path.exists(final_logo_path):
+    if logo_bytes and (not is_svg or _load_cairosvg()):
         try:
-            img = ImageReader(final_logo_path)
-            iw, ih = img.getSize()
+            # Only the PNG bytes are shared; ImageReader is stateful, so each render gets its own
+            logo = ImageReader(io.BytesIO(_logo_png(logo_bytes, is_svg)))
+            iw, ih = logo.getSize()
             draw_h = logo_w * (ih / iw)
-            c.drawImage(img, margin_x, header_y - (draw_h / 2), width=logo_w, height=draw_h, mask='auto')
+            c.drawImage(logo, margin_x, header_y - (draw_h / 2), width=logo_w, height=draw_h, mask='auto')
             logo_drawn = True
-        except: pass
+        except Exception as e:
+            print(f"Logo processing failed: {e}")
 
     # Company Name
     text_x = margin_x + logo_w + 20 if logo_drawn else margin_x
@@ -140,10 +175,10 @@ def create_invoice_pdf(data, logo_path, output_filename):
     c.drawString(text_x, header_y - 12, first_part)
     if rest_part:
         c.setFillColor(SECONDARY)
-        c.drawString(text_x + c.stringWidth(first_part, "Helvetica-Bold", 32) + 12, header_y - 12, rest_part)
+        c.drawString(text_x + _sw(first_part, "Helvetica-Bold", 32) + 12, header_y - 12, rest_part)
 
     # Company Details (Right-aligned)
-    c.setFillColor(TEXT_MAIN)
+    c.setFillColor(_TEXT_MAIN)
     c.setFont("Helvetica", 9)
     info_x = width - margin_x
     c.drawRightString(info_x, header_y + 15, full_name)
@@ -153,110 +188,124 @@ def create_invoice_pdf(data, logo_path, output_filename):
     curr_y = header_y - 65
 
     # 3. CUSTOMER INFORMATION
-    c.setFillColor(BG_SECTION)
+    c.setFillColor(_BG_SECTION)
     c.roundRect(margin_x, curr_y, 160, 24, 4, fill=1, stroke=0)
-    c.setFillColor(TEXT_MAIN)
+    c.setFillColor(_TEXT_MAIN)
     c.setFont("Helvetica-Bold", 10)
     c.drawString(margin_x + 10, curr_y + 7, "CUSTOMER INFORMATION")
     
     curr_y -= 30
-    c.setFont("Helvetica-Bold", 9)
-    customer_fields = [
-        ("COMPANY", data.get('client_name', '')),
-        ("PHONE NO", data.get('client_phone', '')),
-        ("EMAIL", data.get('client_email', ''))
-    ]
-    
-    for label, val in customer_fields:
-        c.setFont("Helvetica-Bold", 8)
-        c.drawString(margin_x, curr_y, label)
-        c.setFont("Helvetica", 9)
-        c.drawString(margin_x + 90, curr_y, val)
-        c.setLineWidth(0.5)
-        c.setStrokeColor(SECONDARY)
-        c.line(margin_x + 90, curr_y - 2, width - margin_x, curr_y - 2)
-        curr_y -= 20
+    # Draw all labels, then all values, so each font is set only once
+    c.setFont("Helvetica-Bold", 8)
+    for i, (label, _) in enumerate(_CUSTOMER_FIELDS):
+        c.drawString(margin_x, curr_y - i * 20, label)
+
+    c.setFont("Helvetica", 9)
+    underlines = c.beginPath()
+    for i, (_, key) in enumerate(_CUSTOMER_FIELDS):
+        row_y = curr_y - i * 20
+        c.drawString(margin_x + 90, row_y, data.get(key, ''))
+        underlines.moveTo(margin_x + 90, row_y - 2)
+        underlines.lineTo(width - margin_x, row_y - 2)
+    c.setLineWidth(0.5)
+    c.setStrokeColor(SECONDARY)
+    c.drawPath(underlines, stroke=1, fill=0)
+    curr_y -= 20 * len(_CUSTOMER_FIELDS)
 
     curr_y -= 25
 
     # 4. ORDER DETAILS
-    c.setFillColor(BG_SECTION)
+    c.setFillColor(_BG_SECTION)
     c.roundRect(margin_x, curr_y, 120, 24, 4, fill=1, stroke=0)
-    c.setFillColor(TEXT_MAIN)
+    c.setFillColor(_TEXT_MAIN)
     c.setFont("Helvetica-Bold", 10)
     c.drawString(margin_x + 10, curr_y + 7, "ORDER DETAILS")
     
     curr_y -= 35
     # Table Header
-    c.setStrokeColor(BORDER)
-    c.setFillColor(BG_SECTION)
+    c.setStrokeColor(_BORDER)
+    c.setFillColor(_BG_SECTION)
     c.rect(margin_x, curr_y, width - (margin_x * 2), 35, fill=1, stroke=1)
     
-    c.setFillColor(TEXT_MAIN)
+    c.setFillColor(_TEXT_MAIN)
     c.setFont("Helvetica-Bold", 8)
-    table_headers = [("NO.", 55), ("ITEM DESCRIPTION", 230), ("QTY", 375), ("PRICE", 435), ("DISCOUNT", 500), ("TOTAL", 555)]
-    for txt, x in table_headers:
+    for txt, x in _TABLE_HEADERS:
         c.drawCentredString(x, curr_y + 12, txt)
 
     # Table Rows
     curr_y -= 30
-    c.setFont("Helvetica", 8)
-    subtotal = 0.0
-    idx = 0
-    while f"product_name_{idx}" in data:
-        name = data.get(f"product_name_{idx}", "").strip()
-        if name:
-            qty = data.get(f"product_quantity_{idx}", "0")
-            price = data.get(f"product_price_{idx}", "0")
-            total_raw = data.get(f"product_total_{idx}", "0").replace('$', '').replace(',', '').strip()
-            
-            # Draw dividers
-            cols_x = [40, 70, 320, 390, 440, 490, 535, 580]
-            for i in range(len(cols_x) - 1):
-                c.rect(cols_x[i], curr_y, cols_x[i+1] - cols_x[i], 30, stroke=1)
-            
-            c.drawCentredString(55, curr_y + 10, str(idx + 1))
-            c.drawString(75, curr_y + 10, name)
-            c.drawCentredString(415, curr_y + 10, qty)
-            c.drawCentredString(465, curr_y + 10, f"{price} PKR")
-            c.drawCentredString(512, curr_y + 10, "0 PKR")
-            c.drawCentredString(557, curr_y + 10, f"{total_raw} PKR")
-            
-            try: subtotal += float(total_raw)
-            except: pass
-            
-            curr_y -= 30
-        idx += 1
+    rows = _collect_rows(data)
+    # Cleaned once here; the draw loop reuses these strings
+    totals_raw = [row.get('total', '0').translate(_TBL).strip() for row in rows]
+    totals = [_safe_float(t) for t in totals_raw]
+    try:
+        subtotal = math.fsum(totals)
+    except OverflowError:
+        # Finite totals whose sum leaves the float range, e.g. two 1e308 rows
+        subtotal = math.copysign(math.inf, sum(totals))
+    grid = c.beginPath()
+    # All cell text goes into one text object instead of a BT/ET block per string
+    cells = c.beginText()
+    cells.setFont("Helvetica", 8)
+    for i, row in enumerate(rows):
+        name = row['name'].strip()
+        qty = row.get('quantity', '0')
+        price = row.get('price', '0')
+        total_raw = totals_raw[i]
+
+        # Queue dividers; the whole grid is stroked once after the loop
+        for x in _COLS_X:
+            grid.moveTo(x, curr_y)
+            grid.lineTo(x, curr_y + 30)
+        grid.moveTo(_COLS_X[0], curr_y)
+        grid.lineTo(_COLS_X[-1], curr_y)
+        grid.moveTo(_COLS_X[0], curr_y + 30)
+        grid.lineTo(_COLS_X[-1], curr_y + 30)
+
+        cells.setTextOrigin(75, curr_y + 10)
+        cells.textOut(name)
+        for x, val in ((55, str(i + 1)), (415, qty), (465, f"{price} PKR"), (512, "0 PKR"), (557, f"{total_raw} PKR")):
+            cells.setTextOrigin(x - _sw(val, "Helvetica", 8) / 2, curr_y + 10)
+            cells.textOut(val)
+
+        curr_y -= 30
+
+    if rows:
+        c.drawText(cells)
+        c.drawPath(grid, stroke=1, fill=0)
 
     # Totals Table
     curr_y -= 10
     total_w = 110
     start_x = width - margin_x - total_w
     
+    # Background and outer border for both rows, then the inner gridlines
+    c.setFillColor(_BG_SECTION)
+    c.rect(start_x, curr_y - 25, total_w, 50, fill=1, stroke=1)
+    p = c.beginPath()
+    p.moveTo(start_x, curr_y)
+    p.lineTo(start_x + total_w, curr_y)
+    p.moveTo(start_x + total_w / 2, curr_y - 25)
+    p.lineTo(start_x + total_w / 2, curr_y + 25)
+    c.drawPath(p, stroke=1, fill=0)
+
     # GST TAX 5% row
-    c.setFillColor(BG_SECTION)
-    c.rect(start_x, curr_y, total_w / 2, 25, fill=1, stroke=1)
-    c.rect(start_x + total_w / 2, curr_y, total_w / 2, 25, fill=1, stroke=1)
-    c.setFillColor(TEXT_MAIN)
+    c.setFillColor(_TEXT_MAIN)
     c.setFont("Helvetica-Bold", 7)
     c.drawString(start_x + 5, curr_y + 8, "GST TAX 5%")
-    c.drawRightString(width - margin_x - 5, curr_y + 8, f"{subtotal * 0.05:,.0f} PKR")
+    c.drawRightString(width - margin_x - 5, curr_y + 8, _PKR_FMT(subtotal * 0.05))
     
     # TOTAL row
     curr_y -= 25
-    c.setFillColor(BG_SECTION)
-    c.rect(start_x, curr_y, total_w / 2, 25, fill=1, stroke=1)
-    c.rect(start_x + total_w / 2, curr_y, total_w / 2, 25, fill=1, stroke=1)
-    c.setFillColor(TEXT_MAIN)
     c.setFont("Helvetica-Bold", 9)
     c.drawString(start_x + 10, curr_y + 8, "TOTAL")
-    c.drawRightString(width - margin_x - 5, curr_y + 8, f"{subtotal * 1.05:,.0f} PKR")
+    c.drawRightString(width - margin_x - 5, curr_y + 8, _PKR_FMT(subtotal * 1.05))
 
     # 5. DELIVERY DETAILS
     curr_y -= 50
-    c.setFillColor(BG_SECTION)
+    c.setFillColor(_BG_SECTION)
     c.roundRect(margin_x, curr_y, 110, 24, 4, fill=1, stroke=0)
-    c.setFillColor(TEXT_MAIN)
+    c.setFillColor(_TEXT_MAIN)
     c.setFont("Helvetica-Bold", 9)
     c.drawString(margin_x + 10, curr_y + 7, "DELIVERY DETAILS")
     
@@ -285,46 +334,42 @@ def create_invoice_pdf(data, logo_path, output_filename):
     c.line(margin_x, 45, width - margin_x, 45)
     
     c.setFont("Helvetica", 8)
-    c.drawCentredString(width / 2, 30, f"📧 {data.get('company_email', '')}    |    🌐 www.lancerstech.com")
+    c.drawCentredString(width / 2, 30, _FOOTER_PREFIX + data.get('company_email', '') + _FOOTER_SEP + "www.lancerstech.com")
     
     c.save()
-    if logo_path and logo_path.lower().endswith('.svg') and final_logo_path and os.path.exists(final_logo_path):
-        try: os.remove(final_logo_path)
-        except: pass
+
+# index.html has no per-request context, so it is rendered once per process
+_INDEX_HTML = None
 
 @app.route('/')
 def index():
-    return render_template('index.html')
+    global _INDEX_HTML
+    if _INDEX_HTML is None:
+        _INDEX_HTML = render_template('index.html')
+    return _INDEX_HTML
 
 @app.route('/generate-invoice', methods=['POST'])
 def generate_invoice():
-    logo_path = None
+    logo_bytes = None
+    is_svg = False
     try:
         if 'logo' in request.files:
             file = request.files['logo']
             if file and allowed_file(file.filename):
-                filename = secure_filename(file.filename)
-                save_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-                file.save(save_path)
-                logo_path = save_path
+                # Bounded by MAX_CONTENT_LENGTH, so it is safe to hold in memory
+                logo_bytes = file.stream.read()
+                is_svg = file.filename.lower().endswith('.svg')
         
         data = request.form.to_dict()
-        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        output_file = os.path.join(app.config['OUTPUT_FOLDER'], f"inv_{timestamp}.pdf")
-        
-        create_invoice_pdf(data, logo_path, output_file)
-        return send_file(output_file, as_attachment=True, download_name='invoice.pdf')
+        buf = io.BytesIO()
+        _POOL.submit(create_invoice_pdf, data, logo_bytes, is_svg, buf).result()
+        buf.seek(0)
+        return send_file(buf, mimetype='application/pdf', as_attachment=True, download_name='invoice.pdf')
     except Exception as e:
         print(f"Server Error: {e}")
         return jsonify({'error': str(e)}), 500
-    finally:
-        if logo_path and os.path.exists(logo_path):
-            try: os.remove(logo_path)
-            except: pass
 
 if __name__ == '__main__':
-    # Cleanup thread only needed for persistent servers
     if not IS_VERCEL:
-        start_cleanup_thread()
         port = int(os.environ.get("PORT", 5000))
         app.run(debug=False, host='0.0.0.0', port=port)
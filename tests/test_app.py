@@ -0,0 +1,66 @@
+import hashlib
+import io
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image
+
+from invoice.app import _POOL, _collect_rows, _logo_cache, _logo_png, _safe_float, create_invoice_pdf
+
+
+def _png_logo(size):
+    buf = io.BytesIO()
+    Image.new('RGB', size, '#f7a80a').save(buf, format='PNG')
+    return buf.getvalue()
+
+
+def _render(data, logo_bytes=None, is_svg=False):
+    buf = io.BytesIO()
+    _POOL.submit(create_invoice_pdf, data, logo_bytes, is_svg, buf).result()
+    return buf.getvalue()
+
+
+def test_raster_logo_is_cached_at_drawn_size():
+    png = _logo_png(_png_logo((3000, 3000)), False)
+    with Image.open(io.BytesIO(png)) as img:
+        assert img.size == (160, 160)
+
+
+def test_concurrent_renders_share_logo_safely():
+    logo = _png_logo((3000, 3000))
+    data = {'product_name_0': 'Item', 'product_total_0': '10'}
+    with ThreadPoolExecutor(max_workers=40) as ex:
+        pdfs = list(ex.map(lambda _: _render(data, logo), range(40)))
+    assert all(b'/Subtype /Image' in pdf for pdf in pdfs)
+
+
+def test_extreme_totals_still_render():
+    for totals in (('1e308', '1e308'), ('inf', '-inf'), ('nan', '12')):
+        data = {}
+        for i, total in enumerate(totals):
+            data[f'product_name_{i}'] = 'Item'
+            data[f'product_total_{i}'] = total
+        assert _render(data).startswith(b'%PDF')
+
+
+def test_logo_cache_is_keyed_by_format():
+    raw = _png_logo((10, 10))
+    _logo_png(raw, False)
+    # Same bytes claimed as SVG must be rasterized separately, not served from the PNG entry
+    assert (hashlib.sha1(raw).hexdigest(), True) not in _logo_cache
+    assert (hashlib.sha1(raw).hexdigest(), False) in _logo_cache
+
+
+def test_row_keys_reject_newlines_and_non_ascii_digits():
+    rows = _collect_rows({
+        'product_name_1': 'Kept',
+        'product_name_1\n': 'Trailing newline',
+        'product_name_١': 'Arabic-Indic one',
+    })
+    assert rows == [{'name': 'Kept'}]
+
+
+def test_safe_float_rejects_malformed_and_non_finite():
+    assert _safe_float('2700.00') == 2700.0
+    assert _safe_float('abc') == 0.0
+    assert _safe_float('inf') == 0.0
+    assert _safe_float('nan') == 0.0